@@ -1,5 +1,4 @@
 import argparse
-import json
 import time
 from dataclasses import asdict, dataclass, replace
 from pathlib import Path
@@ -8,6 +7,10 @@ from typing import Any, Self
 from PIL import Image
 
 from image_utils import calculate_rms
+from integrity import IntegrityChecker, print_report
+from search_index import SearchIndex
+from thumbnails import Thumbnailer
+from utils import load_json_file, write_json_file
 
 
 @dataclass(frozen=True, kw_only=True)
@@ -107,13 +110,17 @@ class EntryManager:
         ad_images_dir: Path,
         cover_images_dir: Path,
         fiction_json_file_path: Path,
+        search_index_file_path: Path,
         debug_dir_path: Path,
+        thumbnailer: Thumbnailer,
     ):
         self.ad_json_file_path = ad_images_dir / "entries.json"
         self.ad_images_dir = ad_images_dir
         self.cover_images_dir = cover_images_dir
         self.fiction_json_file_path = fiction_json_file_path
+        self.search_index_file_path = search_index_file_path
         self.debug_dir_path = debug_dir_path
+        self.thumbnailer = thumbnailer
 
         # create directories if they do not exist
         self.ad_images_dir.mkdir(exist_ok=True, parents=True)
@@ -122,6 +129,7 @@ class EntryManager:
 
         self.ad_entries = self._load_ad_entries()
         self.fiction = self._load_fiction_entries()
+        self.search_index = self._build_search_index()
 
     @classmethod
     def from_defaults(cls) -> Self:
@@ -130,20 +138,15 @@ class EntryManager:
             ad_images_dir=here / "public" / "300x250",
             cover_images_dir=here / "public" / "200x300",
             fiction_json_file_path=here / "public" / "fiction.json",
+            search_index_file_path=here / "public" / "search.json",
             debug_dir_path=here / "debug",
-        )
-
-    def _load_json_file(self, json_file_path: Path) -> dict[str, Any]:
-        return (
-            json.loads(json_file_path.read_text(encoding="utf-8"))
-            if json_file_path.exists()
-            else {}
+            thumbnailer=Thumbnailer.from_defaults(),
         )
 
     def _load_ad_entries(self) -> dict[str, AdEntry]:
         entries: dict[str, AdEntry] = {}
 
-        content = self._load_json_file(self.ad_json_file_path)
+        content = load_json_file(self.ad_json_file_path)
 
         for uid, entry_dict in reversed(content.get("entries", {}).items()):
             image = Image.open(self.ad_images_dir / f"{uid}.webp")
@@ -158,7 +161,7 @@ class EntryManager:
     def _load_fiction_entries(self) -> dict[int, FictionEntry]:
         entries: dict[int, FictionEntry] = {}
 
-        content = self._load_json_file(self.fiction_json_file_path)
+        content = load_json_file(self.fiction_json_file_path)
 
         for fiction_id_str, entry_dict in reversed(content.get("entries", {}).items()):
             fiction_id = int(fiction_id_str)
@@ -169,6 +172,22 @@ class EntryManager:
 
         return entries
 
+    def _build_search_index(self) -> SearchIndex:
+        search_index = SearchIndex()
+        for entry in self.fiction.values():
+            self._add_to_search_index(search_index, entry)
+        return search_index
+
+    @staticmethod
+    def _add_to_search_index(search_index: SearchIndex, entry: FictionEntry) -> None:
+        search_index.add(
+            entry.id,
+            title=entry.title,
+            description=entry.description,
+            tags=entry.tags,
+            author_name=entry.author_name,
+        )
+
     def find_duplicate_ad_entry(self, new_entry: AdEntry) -> AdEntry | None:
         """Returns an ad entry that has the same image as this one"""
 
@@ -198,6 +217,15 @@ class EntryManager:
         self.ad_entries[new_entry.uid] = new_entry
         self._write_ad_entries_to_file()
 
+        # thumbnails are not essential, a failure is retried by the next backfill.
+        # sprites are left to the backfill, rather than rebuilt for every ad
+        try:
+            self.thumbnailer.update_ads(
+                self._ad_timestamps(), uids=[new_entry.uid], update_sprites=False
+            )
+        except Exception as exception:
+            print("Failed to update ad thumbnails:", exception)
+
     def save_fiction_entry(self, entry: FictionEntry) -> None:
         if entry.cover_image.size != (200, 300):
             entry = replace(entry, cover_image=entry.cover_image.resize((200, 300)))
@@ -214,6 +242,26 @@ class EntryManager:
         self.fiction[entry.id] = entry
         self._write_fiction_entries_to_file()
 
+        self._add_to_search_index(self.search_index, entry)
+        self.write_search_index()
+
+        try:
+            self.thumbnailer.update_covers(self.fiction, fiction_ids=[entry.id])
+        except Exception as exception:
+            print("Failed to update cover thumbnails:", exception)
+
+    def write_search_index(self) -> None:
+        self.search_index.write(self.search_index_file_path)
+
+    def _ad_timestamps(self) -> dict[str, int]:
+        return {uid: entry.timestamp for uid, entry in self.ad_entries.items()}
+
+    def backfill_thumbnails(self) -> None:
+        """Generates any missing or outdated thumbnails and sprites"""
+
+        self.thumbnailer.update_ads(self._ad_timestamps())
+        self.thumbnailer.update_covers(self.fiction)
+
     @staticmethod
     def _write_entries_to_file(
         json_file_path: Path, opaque_entries: dict[Any, Any]
@@ -222,10 +270,7 @@ class EntryManager:
         for key, entry in reversed(opaque_entries.items()):
             entries[str(key)] = entry.dict()
 
-        content = {"entries": entries}
-
-        with open(json_file_path, "w") as fp:
-            json.dump(obj=content, fp=fp, indent=2)
+        write_json_file(json_file_path, {"entries": entries})
 
     def _write_fiction_entries_to_file(self) -> None:
         return self._write_entries_to_file(self.fiction_json_file_path, self.fiction)
@@ -233,35 +278,102 @@ class EntryManager:
     def _write_ad_entries_to_file(self) -> None:
         return self._write_entries_to_file(self.ad_json_file_path, self.ad_entries)
 
-    def check_for_missing_ad_entries(self, delete: bool = False) -> None:
-        webp_paths = list(self.ad_images_dir.glob("*.webp"))
-        for webp_path in webp_paths:
-            if webp_path.stem in self.ad_entries:
-                continue
-
-            if delete:
-                print("Removing", webp_path)
-                webp_path.unlink()
-            else:
-                print(webp_path.name, "is missing from", self.ad_json_file_path.name)
-
-        print(f"{len(webp_paths)}/{len(self.ad_entries)}")
-
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Entry Manager operations")
     subparser = parser.add_subparsers(dest="command", help="subcommand", required=True)
 
-    check_parser = subparser.add_parser("check", help="Check for missing entries")
-    check_parser.add_argument("-d", "--delete", action="store_true")
+    check_parser = subparser.add_parser(
+        "check", help="Check ads, covers and debug images for missing/corrupt files"
+    )
+    orphan_group = check_parser.add_mutually_exclusive_group()
+    orphan_group.add_argument(
+        "-d", "--delete", action="store_true", help="Delete orphaned images"
+    )
+    orphan_group.add_argument(
+        "-q",
+        "--quarantine",
+        action="store_true",
+        help="Move orphaned images to the debug directory",
+    )
+    check_parser.add_argument(
+        "--drop-dangling",
+        action="store_true",
+        help="Drop json entries whose image is missing or corrupt, moving "
+        "corrupt images to the debug directory",
+    )
+    check_parser.add_argument(
+        "--purge-debug",
+        action="store_true",
+        help="Delete corrupt images from the debug directory",
+    )
+    check_parser.add_argument(
+        "--refetch-covers",
+        action="store_true",
+        help="Refetch missing or corrupt cover images from the API",
+    )
+    check_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of files to verify in parallel",
+    )
+
+    subparser.add_parser(
+        "search-index",
+        help="Write the fiction search index (one-off, saves keep it up to date)",
+    )
+
+    subparser.add_parser(
+        "thumbnails", help="Generate missing or outdated thumbnails and sprites"
+    )
 
     args = parser.parse_args()
 
-    entry_manager = EntryManager.from_defaults()
-
     match args.command:
         case "check":
-            entry_manager.check_for_missing_ad_entries(delete=args.delete)
+            # EntryManager opens every image on load, which fails if any are
+            # missing, so checks run against the json files directly
+            checker = IntegrityChecker.from_defaults(max_workers=args.jobs)
+            report = checker.verify()
+            print_report(report)
+
+            if args.refetch_covers and report.dangling_fiction:
+                import config
+                from api import API
+
+                api = API.from_refresh_token(
+                    config.RR_REFRESH_TOKEN, config.RR_CLIENT_SECRET
+                )
+
+                def fetch_cover_image(fiction_id: int) -> Image.Image | None:
+                    entry = api.get_fiction(fiction_id)
+                    return entry.cover_image if entry else None
+
+                checker.refetch_covers(report, fetch_cover_image)
+
+            if args.drop_dangling:
+                checker.drop_dangling(report)
+
+            if args.purge_debug:
+                checker.remove_corrupt_debug(report)
+
+            # derived assets can only be rebuilt once every entry has an image
+            repaired = args.refetch_covers or args.drop_dangling
+            if repaired and not (report.dangling_ads or report.dangling_fiction):
+                entry_manager = EntryManager.from_defaults()
+                entry_manager.write_search_index()
+                entry_manager.backfill_thumbnails()
+
+            if args.delete or args.quarantine:
+                checker.remove_orphans(report, delete=args.delete)
+
+        case "search-index":
+            EntryManager.from_defaults().write_search_index()
+
+        case "thumbnails":
+            EntryManager.from_defaults().backfill_thumbnails()
 
 
 if __name__ == "__main__":
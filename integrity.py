@@ -0,0 +1,335 @@
+import os
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from typing import Any, Self
+
+from PIL import Image
+
+from utils import hash_file, load_json_file, write_json_file
+
+
+@dataclass(frozen=True, kw_only=True)
+class AssetRecord:
+    size: int
+    mtime_ns: int
+    sha256: str
+    error: str | None = None
+
+    def is_current(self, stat: os.stat_result) -> bool:
+        """Returns true if the file has not changed since this record was made"""
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+    def dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass(kw_only=True)
+class IntegrityReport:
+    checked: int = 0
+    rehashed: int = 0
+
+    # referenced from a json file, but missing or unreadable (uid/id -> reason)
+    dangling_ads: dict[str, str] = field(default_factory=dict)
+    dangling_fiction: dict[int, str] = field(default_factory=dict)
+
+    # present on disk, but not referenced from a json file
+    orphans: list[Path] = field(default_factory=list)
+
+    # unreadable files in the debug directory
+    corrupt_debug: dict[Path, str] = field(default_factory=dict)
+
+    # files whose content differs from the last check. this is informational
+    # only, since save_fiction_entry legitimately overwrites covers
+    changed: list[Path] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (
+            self.dangling_ads
+            or self.dangling_fiction
+            or self.orphans
+            or self.corrupt_debug
+        )
+
+
+def verify_asset(
+    path: Path, expected_size: tuple[int, int] | None, previous: AssetRecord | None
+) -> AssetRecord:
+    """Hashes the file and fully decodes it to catch truncated/corrupt images.
+
+    Decoding is skipped if the content matches the previous record.
+    """
+
+    stat = path.stat()
+    sha256 = hash_file(path)
+
+    if previous and previous.sha256 == sha256:
+        return replace(previous, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    error = None
+    try:
+        with Image.open(path) as image:
+            image.load()
+            if expected_size and image.size != expected_size:
+                error = f"unexpected size {image.size}"
+    except Exception as exception:
+        error = str(exception) or type(exception).__name__
+
+    return AssetRecord(
+        size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256, error=error
+    )
+
+
+class IntegrityChecker:
+    ad_image_size = (300, 250)
+    cover_image_size = (200, 300)
+
+    def __init__(
+        self,
+        ad_images_dir: Path,
+        cover_images_dir: Path,
+        fiction_json_file_path: Path,
+        debug_dir_path: Path,
+        manifest_file_path: Path,
+        max_workers: int | None = None,
+    ):
+        self.ad_json_file_path = ad_images_dir / "entries.json"
+        self.ad_images_dir = ad_images_dir
+        self.cover_images_dir = cover_images_dir
+        self.fiction_json_file_path = fiction_json_file_path
+        self.debug_dir_path = debug_dir_path
+        self.manifest_file_path = manifest_file_path
+        self.max_workers = max_workers
+
+        self.manifest = self._load_manifest()
+
+    @classmethod
+    def from_defaults(cls, max_workers: int | None = None) -> Self:
+        here = Path(__file__).parent
+        return cls(
+            ad_images_dir=here / "public" / "300x250",
+            cover_images_dir=here / "public" / "200x300",
+            fiction_json_file_path=here / "public" / "fiction.json",
+            debug_dir_path=here / "debug",
+            manifest_file_path=here / "manifest.json",
+            max_workers=max_workers,
+        )
+
+    def _manifest_key(self, path: Path) -> str:
+        try:
+            return path.relative_to(self.manifest_file_path.parent).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def _load_manifest(self) -> dict[str, AssetRecord]:
+        content = load_json_file(self.manifest_file_path)
+        return {
+            key: AssetRecord(**record)
+            for key, record in content.get("assets", {}).items()
+        }
+
+    def _write_manifest(self) -> None:
+        assets = {key: record.dict() for key, record in sorted(self.manifest.items())}
+        write_json_file(self.manifest_file_path, {"assets": assets})
+
+    def _check_assets(
+        self, assets: dict[Path, tuple[int, int] | None], report: IntegrityReport
+    ) -> dict[Path, AssetRecord]:
+        """Returns a record for every asset, only rehashing files that have changed"""
+
+        records: dict[Path, AssetRecord] = {}
+        stale: dict[Path, tuple[int, int] | None] = {}
+        previous: dict[Path, AssetRecord | None] = {}
+
+        for path, expected_size in assets.items():
+            record = self.manifest.get(self._manifest_key(path))
+            if record and record.is_current(path.stat()):
+                records[path] = record
+            else:
+                stale[path] = expected_size
+                previous[path] = record
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for path, record in zip(
+                stale,
+                executor.map(verify_asset, stale, stale.values(), previous.values()),
+            ):
+                records[path] = record
+
+                old_record = previous[path]
+                if old_record and old_record.sha256 != record.sha256:
+                    report.changed.append(path)
+
+        for path, record in records.items():
+            self.manifest[self._manifest_key(path)] = record
+
+        report.checked += len(records)
+        report.rehashed += len(stale)
+        return records
+
+    def verify(self) -> IntegrityReport:
+        report = IntegrityReport()
+
+        ad_uids = load_json_file(self.ad_json_file_path).get("entries", {})
+        fiction_ids = load_json_file(self.fiction_json_file_path).get(
+            "entries", {}
+        )
+
+        assets: dict[Path, tuple[int, int] | None] = {}
+        for webp_path in self.ad_images_dir.glob("*.webp"):
+            assets[webp_path] = self.ad_image_size
+        for webp_path in self.cover_images_dir.glob("*.webp"):
+            assets[webp_path] = self.cover_image_size
+        for webp_path in self.debug_dir_path.glob("*.webp"):
+            assets[webp_path] = None
+
+        records = self._check_assets(assets, report)
+
+        # forget about files that no longer exist
+        known_keys = {self._manifest_key(path) for path in records}
+        self.manifest = {
+            key: record for key, record in self.manifest.items() if key in known_keys
+        }
+        self._write_manifest()
+
+        for uid in ad_uids:
+            path = self.ad_images_dir / f"{uid}.webp"
+            if path not in records:
+                report.dangling_ads[uid] = "missing"
+            elif error := records[path].error:
+                report.dangling_ads[uid] = error
+
+        for fiction_id_str in fiction_ids:
+            path = self.cover_images_dir / f"{fiction_id_str}.webp"
+            if path not in records:
+                report.dangling_fiction[int(fiction_id_str)] = "missing"
+            elif error := records[path].error:
+                report.dangling_fiction[int(fiction_id_str)] = error
+
+        for path, record in records.items():
+            if path.parent == self.debug_dir_path:
+                if record.error:
+                    report.corrupt_debug[path] = record.error
+            elif path.parent == self.ad_images_dir:
+                if path.stem not in ad_uids:
+                    report.orphans.append(path)
+            elif path.stem not in fiction_ids:
+                report.orphans.append(path)
+
+        return report
+
+    def _quarantine(self, path: Path) -> None:
+        # don't overwrite an earlier file with the same name
+        destination = self.debug_dir_path / path.name
+        suffix = 0
+        while destination.exists():
+            suffix += 1
+            destination = self.debug_dir_path / f"{path.stem}.{suffix}{path.suffix}"
+
+        print("Quarantining", path, "to", destination)
+        self.debug_dir_path.mkdir(exist_ok=True, parents=True)
+        path.rename(destination)
+
+        if record := self.manifest.pop(self._manifest_key(path), None):
+            # moving a file keeps its contents, so the record can follow it
+            stat = destination.stat()
+            self.manifest[self._manifest_key(destination)] = replace(
+                record, size=stat.st_size, mtime_ns=stat.st_mtime_ns
+            )
+
+    def _remove(self, path: Path) -> None:
+        print("Removing", path)
+        path.unlink()
+        self.manifest.pop(self._manifest_key(path), None)
+
+    def refetch_covers(
+        self,
+        report: IntegrityReport,
+        fetch_cover_image: Callable[[int], Image.Image | None],
+    ) -> None:
+        for fiction_id in list(report.dangling_fiction):
+            try:
+                cover_image = fetch_cover_image(fiction_id)
+            except Exception as exception:
+                print("Failed to refetch cover for", fiction_id, exception)
+                continue
+
+            if not cover_image:
+                print("Failed to refetch cover for", fiction_id)
+                continue
+
+            if cover_image.size != self.cover_image_size:
+                cover_image = cover_image.resize(self.cover_image_size)
+
+            image_path = self.cover_images_dir / f"{fiction_id}.webp"
+            if image_path.exists():
+                self._quarantine(image_path)
+            cover_image.save(image_path, "webp")
+            print("Refetched cover for", fiction_id)
+            del report.dangling_fiction[fiction_id]
+
+        self._write_manifest()
+
+    def drop_dangling(self, report: IntegrityReport) -> None:
+        if report.dangling_ads:
+            content = load_json_file(self.ad_json_file_path)
+            for uid in report.dangling_ads:
+                print("Dropping ad entry", uid)
+                del content["entries"][uid]
+                if (path := self.ad_images_dir / f"{uid}.webp").exists():
+                    self._quarantine(path)
+            write_json_file(self.ad_json_file_path, content)
+            report.dangling_ads.clear()
+
+        if report.dangling_fiction:
+            content = load_json_file(self.fiction_json_file_path)
+            for fiction_id in report.dangling_fiction:
+                print("Dropping fiction entry", fiction_id)
+                del content["entries"][str(fiction_id)]
+                if (path := self.cover_images_dir / f"{fiction_id}.webp").exists():
+                    self._quarantine(path)
+            write_json_file(self.fiction_json_file_path, content)
+            report.dangling_fiction.clear()
+
+        self._write_manifest()
+
+    def remove_orphans(self, report: IntegrityReport, delete: bool = False) -> None:
+        for path in report.orphans:
+            if delete:
+                self._remove(path)
+            else:
+                self._quarantine(path)
+        report.orphans.clear()
+
+        self._write_manifest()
+
+    def remove_corrupt_debug(self, report: IntegrityReport) -> None:
+        for path in report.corrupt_debug:
+            self._remove(path)
+        report.corrupt_debug.clear()
+
+        self._write_manifest()
+
+
+def print_report(report: IntegrityReport) -> None:
+    for uid, reason in report.dangling_ads.items():
+        print(f"ad {uid}: {reason}")
+    for fiction_id, reason in report.dangling_fiction.items():
+        print(f"fiction {fiction_id}: {reason}")
+    for path in report.orphans:
+        print(path.name, "is missing from", path.parent.name)
+    for path, reason in report.corrupt_debug.items():
+        print(f"{path}: {reason}")
+    for path in report.changed:
+        print(path, "has changed since the last check")
+
+    print(
+        f"{report.checked} files checked, {report.rehashed} rehashed,",
+        f"{len(report.dangling_ads)} dangling ads,",
+        f"{len(report.dangling_fiction)} dangling fiction,",
+        f"{len(report.orphans)} orphans,",
+        f"{len(report.corrupt_debug)} corrupt in debug,",
+        f"{len(report.changed)} changed",
+    )
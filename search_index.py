@@ -0,0 +1,105 @@
+import html
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+from utils import write_json_file
+
+
+def tokenize(text: str) -> set[str]:
+    """Splits (possibly html) text into lowercase word tokens"""
+
+    text = html.unescape(re.sub(r"<[^>]+>", " ", text))
+    return {token for token in re.findall(r"\w+", text.lower()) if len(token) >= 2}
+
+
+class SearchIndex:
+    """Inverted index from tags, authors and title/description terms to fiction ids.
+
+    Every prefix of a title token is stored as its own key, so the frontend can
+    look up a (lowercased) query term directly instead of scanning fiction.json.
+    Description tokens are only stored whole, as expanding their prefixes would
+    make the index larger than fiction.json. All terms are capped at
+    max_prefix_length characters; longer query terms should be truncated before
+    lookup.
+    """
+
+    min_prefix_length = 2
+    max_prefix_length = 16
+
+    def __init__(self) -> None:
+        self.tags: defaultdict[str, set[int]] = defaultdict(set)
+        self.authors: defaultdict[str, set[int]] = defaultdict(set)
+        self.terms: defaultdict[str, set[int]] = defaultdict(set)
+
+        # keys each fiction was indexed under, ordered by timestamp (asc)
+        self._keys: dict[int, dict[str, set[str]]] = {}
+
+    def _prefixes(self, tokens: set[str]) -> set[str]:
+        return {
+            token[:length]
+            for token in tokens
+            for length in range(
+                self.min_prefix_length,
+                min(len(token), self.max_prefix_length) + 1,
+            )
+        }
+
+    def _maps(self) -> dict[str, defaultdict[str, set[int]]]:
+        return {"tags": self.tags, "authors": self.authors, "terms": self.terms}
+
+    def remove(self, fiction_id: int) -> None:
+        if not (keys := self._keys.pop(fiction_id, None)):
+            return
+
+        for name, index in self._maps().items():
+            for key in keys[name]:
+                index[key].discard(fiction_id)
+                if not index[key]:
+                    del index[key]
+
+    def add(
+        self,
+        fiction_id: int,
+        *,
+        title: str,
+        description: str,
+        tags: list[str],
+        author_name: str,
+    ) -> None:
+        # re-adding moves the fiction to the end, mirroring EntryManager.fiction
+        self.remove(fiction_id)
+
+        title_terms = self._prefixes(tokenize(title))
+        description_terms = {
+            token[: self.max_prefix_length] for token in tokenize(description)
+        }
+
+        keys = {
+            "tags": set(tags),
+            "authors": {author_name.strip().lower()},
+            "terms": title_terms | description_terms,
+        }
+
+        for name, index in self._maps().items():
+            for key in keys[name]:
+                index[key].add(fiction_id)
+
+        self._keys[fiction_id] = keys
+
+    def dict(self) -> dict[str, Any]:
+        # postings refer to positions in "ids" (newest first) to keep them short
+        ids = list(reversed(self._keys))
+        position = {fiction_id: index for index, fiction_id in enumerate(ids)}
+
+        d: dict[str, Any] = {"ids": ids}
+        for name, index in self._maps().items():
+            d[name] = {
+                key: sorted(position[fiction_id] for fiction_id in index[key])
+                for key in sorted(index)
+            }
+        return d
+
+    def write(self, json_file_path: Path) -> None:
+        write_json_file(json_file_path, self.dict(), minify=True)
@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+from integrity import IntegrityChecker
+
+
+class IntegrityCheckerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+        root = Path(self.temp_dir.name)
+        self.ad_images_dir = root / "public" / "300x250"
+        self.cover_images_dir = root / "public" / "200x300"
+        self.fiction_json_file_path = root / "public" / "fiction.json"
+        self.debug_dir_path = root / "debug"
+        self.manifest_file_path = root / "manifest.json"
+
+        for directory in (
+            self.ad_images_dir,
+            self.cover_images_dir,
+            self.debug_dir_path,
+        ):
+            directory.mkdir(parents=True)
+
+    def checker(self) -> IntegrityChecker:
+        return IntegrityChecker(
+            ad_images_dir=self.ad_images_dir,
+            cover_images_dir=self.cover_images_dir,
+            fiction_json_file_path=self.fiction_json_file_path,
+            debug_dir_path=self.debug_dir_path,
+            manifest_file_path=self.manifest_file_path,
+        )
+
+    def save_ad(self, uid: str, color: str = "red") -> Path:
+        path = self.ad_images_dir / f"{uid}.webp"
+        Image.new("RGB", (300, 250), color).save(path, "webp")
+        return path
+
+    def write_ad_entries(self, *uids: str) -> None:
+        content = {"entries": {uid: {} for uid in uids}}
+        (self.ad_images_dir / "entries.json").write_text(json.dumps(content))
+
+    def test_unchanged_file_is_not_rehashed(self) -> None:
+        self.save_ad("a")
+        self.write_ad_entries("a")
+
+        self.assertEqual(self.checker().verify().rehashed, 1)
+
+        report = self.checker().verify()
+        self.assertEqual(report.checked, 1)
+        self.assertEqual(report.rehashed, 0)
+        self.assertTrue(report.ok)
+
+    def test_touched_file_with_same_content_is_not_changed(self) -> None:
+        path = self.save_ad("a")
+        self.write_ad_entries("a")
+        self.checker().verify()
+
+        os.utime(path, ns=(1, 1))
+        report = self.checker().verify()
+        self.assertEqual(report.rehashed, 1)
+        self.assertEqual(report.changed, [])
+
+    def test_rewritten_file_is_reported_as_changed(self) -> None:
+        path = self.save_ad("a")
+        self.write_ad_entries("a")
+        self.checker().verify()
+
+        self.save_ad("a", color="blue")
+        os.utime(path, ns=(1, 1))
+        report = self.checker().verify()
+        self.assertEqual(report.changed, [path])
+        self.assertTrue(report.ok)
+
+    def test_truncated_file_is_dangling(self) -> None:
+        path = self.save_ad("a")
+        path.write_bytes(path.read_bytes()[:40])
+        self.write_ad_entries("a", "missing")
+
+        report = self.checker().verify()
+        self.assertEqual(set(report.dangling_ads), {"a", "missing"})
+        self.assertEqual(report.dangling_ads["missing"], "missing")
+
+    def test_orphans_are_reported(self) -> None:
+        path = self.save_ad("a")
+        self.write_ad_entries()
+
+        self.assertEqual(self.checker().verify().orphans, [path])
+
+    def test_quarantine_does_not_overwrite(self) -> None:
+        Image.new("RGB", (300, 250), "blue").save(
+            self.debug_dir_path / "a.webp", "webp"
+        )
+        existing = (self.debug_dir_path / "a.webp").read_bytes()
+        self.save_ad("a")
+        self.write_ad_entries()
+
+        checker = self.checker()
+        checker.remove_orphans(checker.verify())
+
+        self.assertEqual((self.debug_dir_path / "a.webp").read_bytes(), existing)
+        self.assertTrue((self.debug_dir_path / "a.1.webp").exists())
+        self.assertFalse((self.ad_images_dir / "a.webp").exists())
+
+    def test_drop_dangling_quarantines_corrupt_images(self) -> None:
+        path = self.save_ad("a")
+        path.write_bytes(path.read_bytes()[:40])
+        self.save_ad("b")
+        self.write_ad_entries("a", "b")
+
+        checker = self.checker()
+        checker.drop_dangling(checker.verify())
+
+        content = json.loads((self.ad_images_dir / "entries.json").read_text())
+        self.assertEqual(list(content["entries"]), ["b"])
+        self.assertTrue((self.debug_dir_path / "a.webp").exists())
+
+        # the quarantined file is only reported until it is purged
+        checker = self.checker()
+        report = checker.verify()
+        self.assertEqual(list(report.corrupt_debug), [self.debug_dir_path / "a.webp"])
+        checker.remove_corrupt_debug(report)
+        self.assertTrue(self.checker().verify().ok)
+
+    def test_refetch_errors_do_not_abort(self) -> None:
+        self.fiction_json_file_path.write_text(
+            json.dumps({"entries": {"1": {}, "2": {}}})
+        )
+
+        def fetch_cover_image(fiction_id: int) -> Image.Image | None:
+            if fiction_id == 1:
+                raise ConnectionError("network down")
+            return Image.new("RGB", (400, 600))
+
+        checker = self.checker()
+        report = checker.verify()
+        checker.refetch_covers(report, fetch_cover_image)
+
+        self.assertEqual(list(report.dangling_fiction), [1])
+        with Image.open(self.cover_images_dir / "2.webp") as image:
+            self.assertEqual(image.size, (200, 300))
+
+
+if __name__ == "__main__":
+    unittest.main()
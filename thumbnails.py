@@ -0,0 +1,326 @@
+import hashlib
+import math
+import os
+import time
+from collections import defaultdict
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Self
+
+from PIL import Image
+
+from utils import hash_file, load_json_file, write_json_file
+
+
+@dataclass(frozen=True, kw_only=True)
+class SourceRecord:
+    size: int
+    mtime_ns: int
+    sha256: str
+
+    def is_current(self, stat: os.stat_result) -> bool:
+        """Returns true if the file has not changed since this record was made"""
+        return self.size == stat.st_size and self.mtime_ns == stat.st_mtime_ns
+
+    def dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def make_derivative(
+    source: Path,
+    destination: Path,
+    size: tuple[int, int],
+    previous: SourceRecord | None,
+) -> SourceRecord | None:
+    """Resizes source into destination, unless the source hash is unchanged.
+
+    Returns None if the source could not be read.
+    """
+
+    try:
+        stat = source.stat()
+        if previous and previous.is_current(stat):
+            record = previous
+        else:
+            record = SourceRecord(
+                size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=hash_file(source)
+            )
+
+        if previous and previous.sha256 == record.sha256 and destination.exists():
+            return record
+
+        with Image.open(source) as image:
+            image.resize(size, Image.Resampling.LANCZOS).save(destination, "webp")
+    except Exception as exception:
+        print("Failed to create thumbnail from", source, exception)
+        return None
+
+    return record
+
+
+def make_sprite(
+    thumbnail_paths: list[Path], destination: Path, size: tuple[int, int], columns: int
+) -> None:
+    width, height = size
+    rows = math.ceil(len(thumbnail_paths) / columns)
+    sprite_columns = min(columns, len(thumbnail_paths))
+    sprite = Image.new("RGBA", (sprite_columns * width, rows * height))
+
+    for index, thumbnail_path in enumerate(thumbnail_paths):
+        with Image.open(thumbnail_path) as thumbnail:
+            x, y = (index % columns) * width, (index // columns) * height
+            sprite.paste(thumbnail.convert("RGBA"), (x, y))
+
+    sprite.save(destination, "webp")
+
+
+class Thumbnailer:
+    """Generates lower resolution ads/covers and monthly sprite sheets of ads.
+
+    Sprite sheets are listed newest first in sprites/index.json, along with the
+    position of every ad in its sheet, so the gallery can render the initial
+    view from a few requests before loading full size images. Months with more
+    ads than fit in sprite_rows are split across several sheets, as WebP images
+    are limited to 16383px. Within a sheet ads are placed oldest first, so new
+    ads are appended without moving the ones already there.
+    """
+
+    ad_thumbnail_size = (150, 125)
+    cover_thumbnail_size = (100, 150)
+    sprite_columns = 8
+    sprite_rows = 64
+
+    def __init__(
+        self,
+        ad_images_dir: Path,
+        cover_images_dir: Path,
+        ad_thumbnails_dir: Path,
+        cover_thumbnails_dir: Path,
+        sprites_dir: Path,
+        state_file_path: Path,
+        max_workers: int | None = None,
+    ):
+        self.ad_images_dir = ad_images_dir
+        self.cover_images_dir = cover_images_dir
+        self.ad_thumbnails_dir = ad_thumbnails_dir
+        self.cover_thumbnails_dir = cover_thumbnails_dir
+        self.sprites_dir = sprites_dir
+        self.state_file_path = state_file_path
+        self.max_workers = max_workers
+
+        # create directories if they do not exist
+        self.ad_thumbnails_dir.mkdir(exist_ok=True, parents=True)
+        self.cover_thumbnails_dir.mkdir(exist_ok=True, parents=True)
+        self.sprites_dir.mkdir(exist_ok=True, parents=True)
+
+        state = load_json_file(self.state_file_path)
+
+        # source image records the current derivatives were generated from
+        self.ads: dict[str, SourceRecord] = {
+            uid: SourceRecord(**record) for uid, record in state.get("ads", {}).items()
+        }
+        self.covers: dict[int, SourceRecord] = {
+            int(fiction_id): SourceRecord(**record)
+            for fiction_id, record in state.get("covers", {}).items()
+        }
+
+        # sheet -> digest of the ads the sprite was generated from
+        self.sprites: dict[str, str] = state.get("sprites", {})
+
+    @classmethod
+    def from_defaults(cls, max_workers: int | None = None) -> Self:
+        here = Path(__file__).parent
+
+        # kept out of public/ so they aren't deployed until index.html uses them
+        derivatives_dir = here / "derivatives"
+        return cls(
+            ad_images_dir=here / "public" / "300x250",
+            cover_images_dir=here / "public" / "200x300",
+            ad_thumbnails_dir=derivatives_dir / "150x125",
+            cover_thumbnails_dir=derivatives_dir / "100x150",
+            sprites_dir=derivatives_dir / "sprites",
+            state_file_path=here / "thumbnails.json",
+            max_workers=max_workers,
+        )
+
+    def _write_state_to_file(self) -> None:
+        content = {
+            "ads": {uid: record.dict() for uid, record in self.ads.items()},
+            "covers": {
+                str(fiction_id): record.dict()
+                for fiction_id, record in self.covers.items()
+            },
+            "sprites": self.sprites,
+        }
+
+        write_json_file(self.state_file_path, content)
+
+    @staticmethod
+    def _bucket(timestamp: int) -> str:
+        return time.strftime("%Y-%m", time.gmtime(timestamp))
+
+    def update_ads(
+        self,
+        ad_timestamps: dict[str, int],
+        uids: Iterable[str] | None = None,
+        update_sprites: bool = True,
+    ) -> None:
+        """Updates ad thumbnails for uids (all if None) and any stale sprites.
+
+        ad_timestamps must contain every current ad, thumbnails of ads that are
+        missing from it are removed.
+        """
+
+        for uid in self.ads.keys() - ad_timestamps.keys():
+            (self.ad_thumbnails_dir / f"{uid}.webp").unlink(missing_ok=True)
+            del self.ads[uid]
+
+        try:
+            self._update_derivatives(
+                self.ads,
+                list(ad_timestamps if uids is None else uids),
+                self.ad_images_dir,
+                self.ad_thumbnails_dir,
+                self.ad_thumbnail_size,
+            )
+            if update_sprites:
+                self._update_sprites(ad_timestamps)
+        finally:
+            self._write_state_to_file()
+
+    def update_covers(
+        self, current_ids: Iterable[int], fiction_ids: Iterable[int] | None = None
+    ) -> None:
+        """Updates cover thumbnails for fiction_ids (all if None).
+
+        current_ids must contain every current fiction, thumbnails of fiction
+        that are missing from it are removed.
+        """
+
+        current_ids = set(current_ids)
+        for fiction_id in self.covers.keys() - current_ids:
+            (self.cover_thumbnails_dir / f"{fiction_id}.webp").unlink(missing_ok=True)
+            del self.covers[fiction_id]
+
+        try:
+            self._update_derivatives(
+                self.covers,
+                list(current_ids if fiction_ids is None else fiction_ids),
+                self.cover_images_dir,
+                self.cover_thumbnails_dir,
+                self.cover_thumbnail_size,
+            )
+        finally:
+            self._write_state_to_file()
+
+    def _update_derivatives(
+        self,
+        records: dict[Any, SourceRecord],
+        keys: list[Any],
+        source_dir: Path,
+        destination_dir: Path,
+        size: tuple[int, int],
+    ) -> None:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(
+                lambda key: make_derivative(
+                    source_dir / f"{key}.webp",
+                    destination_dir / f"{key}.webp",
+                    size,
+                    records.get(key),
+                ),
+                keys,
+            )
+            for key, record in zip(keys, results):
+                if record:
+                    records[key] = record
+                else:
+                    # forget about it, so that the next backfill retries it
+                    records.pop(key, None)
+                    (destination_dir / f"{key}.webp").unlink(missing_ok=True)
+
+    def _sheets(self, ad_timestamps: dict[str, int]) -> dict[str, list[str]]:
+        """Groups ads into sprite sheets by month, newest sheet first"""
+
+        # only ads with a thumbnail can be placed in a sprite, the rest are
+        # picked up by the next backfill
+        buckets: defaultdict[str, list[str]] = defaultdict(list)
+        for uid, timestamp in sorted(ad_timestamps.items(), key=lambda item: item[1]):
+            if uid in self.ads:
+                buckets[self._bucket(timestamp)].append(uid)
+
+        per_sheet = self.sprite_columns * self.sprite_rows
+
+        sheets: dict[str, list[str]] = {}
+        for bucket in sorted(buckets, reverse=True):
+            uids = buckets[bucket]
+            starts = range(0, len(uids), per_sheet)
+            for part, start in reversed(list(enumerate(starts))):
+                sheets[f"{bucket}-{part}"] = uids[start : start + per_sheet]
+
+        return sheets
+
+    def _update_sprites(self, ad_timestamps: dict[str, int]) -> None:
+        sheets = self._sheets(ad_timestamps)
+
+        # remove sprites of sheets that no longer have ads
+        for sheet in self.sprites.keys() - sheets.keys():
+            (self.sprites_dir / f"{sheet}.webp").unlink(missing_ok=True)
+            del self.sprites[sheet]
+
+        digests = {
+            sheet: hashlib.sha256(
+                "".join(f"{uid}:{self.ads[uid].sha256}\n" for uid in uids).encode()
+            ).hexdigest()
+            for sheet, uids in sheets.items()
+        }
+
+        stale = [
+            sheet
+            for sheet in sheets
+            if self.sprites.get(sheet) != digests[sheet]
+            or not (self.sprites_dir / f"{sheet}.webp").exists()
+        ]
+
+        def update_sprite(sheet: str) -> bool:
+            try:
+                make_sprite(
+                    [self.ad_thumbnails_dir / f"{uid}.webp" for uid in sheets[sheet]],
+                    self.sprites_dir / f"{sheet}.webp",
+                    self.ad_thumbnail_size,
+                    self.sprite_columns,
+                )
+            except Exception as exception:
+                print("Failed to create sprite", sheet, exception)
+                return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for sheet, ok in zip(stale, executor.map(update_sprite, stale)):
+                if ok:
+                    self.sprites[sheet] = digests[sheet]
+                else:
+                    # leave it out of the index, the next backfill retries it
+                    self.sprites.pop(sheet, None)
+                    (self.sprites_dir / f"{sheet}.webp").unlink(missing_ok=True)
+                    del sheets[sheet]
+
+        self._write_sprite_index_to_file(sheets)
+
+    def _write_sprite_index_to_file(self, sheets: dict[str, list[str]]) -> None:
+        width, height = self.ad_thumbnail_size
+        columns = self.sprite_columns
+
+        sprites = []
+        for sheet, uids in sheets.items():
+            entries = {
+                uid: [(index % columns) * width, (index // columns) * height]
+                for index, uid in enumerate(uids)
+            }
+            sprites.append({"file": f"{sheet}.webp", "entries": entries})
+
+        content = {"width": width, "height": height, "sprites": sprites}
+
+        write_json_file(self.sprites_dir / "index.json", content, minify=True)
@@ -1,4 +1,8 @@
+import hashlib
+import json
 import re
+from pathlib import Path
+from typing import Any
 
 from PIL import Image
 from pydoll.elements.web_element import WebElement
@@ -24,3 +28,26 @@ def is_rectangle_ad(image: Image.Image) -> bool:
 def get_fiction_id_from_url(url: str) -> int | None:
     match = re.search(r"royalroad\.com/fiction/(\d+)", url)
     return int(match.group(1)) if match else None
+
+
+def load_json_file(json_file_path: Path) -> dict[str, Any]:
+    return (
+        json.loads(json_file_path.read_text(encoding="utf-8"))
+        if json_file_path.exists()
+        else {}
+    )
+
+
+def write_json_file(
+    json_file_path: Path, content: dict[str, Any], minify: bool = False
+) -> None:
+    with open(json_file_path, "w", encoding="utf-8") as fp:
+        if minify:
+            json.dump(obj=content, fp=fp, separators=(",", ":"), ensure_ascii=False)
+        else:
+            json.dump(obj=content, fp=fp, indent=2)
+
+
+def hash_file(path: Path) -> str:
+    with open(path, "rb") as fp:
+        return hashlib.file_digest(fp, "sha256").hexdigest()